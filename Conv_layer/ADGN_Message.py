@@ -4,12 +4,14 @@
 # !pip install torch-geometric
 # !pip install tensorboardX
 
+import math
 import numpy as np
 import torch
 import torch.optim as optim
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn.init as init
+from torch.nn.utils import parametrize
 
 import os
 import json
@@ -17,13 +19,8 @@ import json
 # Visualization
 from datetime import datetime
 
-# nn module for Neural Network model
-# Implement graph conv, gene conf etc.
-import torch_geometric.nn as pyg_nn
-
-# Performs some graph utlity functions
-import torch_geometric.utils as pyg_utils
-from torch_geometric.utils import add_self_loops, degree
+# Normalized adjacency built once for the static graph
+from adjacency import build_sym_norm_csr
 
 # For graph visualization
 import networkx as nx
@@ -45,89 +42,98 @@ torch.manual_seed(42)
 np.random.seed(42)
 
 
-class ADGNConv(pyg_nn.MessagePassing):
+class Antisymmetric(nn.Module):
+    def __init__(self, gamma: float = 0.1):
+        super(Antisymmetric, self).__init__()
+
+        self.gamma = gamma
+
+    def forward(self, W):
+        # Antisymmetric formulation (paper formula 5) for a stack of (n x n) weights, gamma * I
+        # is subtracted from the diagonals in place instead of building an identity matrix
+        W = W - W.transpose(-1, -2)
+        W.diagonal(dim1=-2, dim2=-1).sub_(self.gamma)
+        return W
+
+
+class ADGNStack(nn.Module):
     def __init__(
         self,
-        in_channels: int,
-        out_channels: int,
+        num_layers: int,
+        hidden_dim: int,
         gamma: float = 0.1,
         epsilon: float = 0.1,
         antisymmetry=True,
     ):
-        super(ADGNConv, self).__init__(
-            aggr="add"
-        )  # "Add" aggregation (can alternatively use mean or max)
-        
-        self.in_channels = in_channels
-        self.out_channels = out_channels
+        super(ADGNStack, self).__init__()
+
+        self.num_layers = num_layers
+        self.hidden_dim = hidden_dim
         self.gamma = gamma
         self.epsilon = epsilon
-        self.act_func = nn.Tanh()
         self.antisymmetry = antisymmetry
-        self.best_accuracy = -1
 
-        # Defines learnable weighs and biases, where W has (nxn) and bias is (n)
+        # Learnable weights and biases of all layers packed together, W is (L x n x n) and bias is (L x n)
         self.Weights = nn.Parameter(
-            torch.zeros((self.in_channels, self.in_channels)), requires_grad=True
+            torch.empty((self.num_layers, self.hidden_dim, self.hidden_dim)),
+            requires_grad=True,
         )
         # As presented in the paper, bias is always learned from the depiction, thus we always set bias
-        self.bias = nn.Parameter(torch.zeros((self.in_channels)), requires_grad=True)
-        # Identity as per formula of paper
-        self.Identity = nn.Parameter(torch.eye(self.in_channels), requires_grad=False)
-
-        # Aggregation function NEVER has learnable parameters
-        self.linear = nn.Linear(self.in_channels, self.out_channels, bias=False)
-
-        # Reset parameters Kaiming takes into account activation function, Xavier does not
-        init.kaiming_uniform(self.Weights, np.sqrt(5))
-        # fan_in and fan_out = number of neurons in and number of neurons out
-        fan_in, _ = init._calculate_fan_in_and_fan_out(self.Weights)
-        bound = np.clip(1 / np.sqrt(fan_in), 0, np.inf)
-        init.uniform_(self.bias, -bound, bound)
-        self.linear.reset_parameters()
+        self.bias = nn.Parameter(
+            torch.empty((self.num_layers, self.hidden_dim)), requires_grad=True
+        )
 
-    def forward(self, x, edge_index):
-        # Antisymmetric formulation (paper formula 5)
-        W = (
-            ((self.Weights - self.Weights.T) - (self.gamma * self.Identity))
-            if self.antisymmetry
-            else self.Weights
+        # Aggregation function weights (L x n x n), NEVER has a bias
+        self.lin_weights = nn.Parameter(
+            torch.empty((self.num_layers, self.hidden_dim, self.hidden_dim)),
+            requires_grad=True,
         )
 
-        # Convolution of neighbors of previous layer PHI*(X(l-1), N_u)
-        # Do forward pass for backprop to learn weights of Linear Layer
-        aggr_x = self.linear(x)
+        self.reset_parameters()
 
-        # Add self loops to edge index
-        edge_index, _ = add_self_loops(edge_index, num_nodes=x.size(0))
+        # W is parametrized as antisymmetric, the transform runs once per forward
+        # on the packed weights of all layers
+        if self.antisymmetry:
+            parametrize.register_parametrization(
+                self, "Weights", Antisymmetric(self.gamma)
+            )
 
-        # Split edge index into row and column
-        row, col = edge_index
+    def reset_parameters(self):
+        # Initialize the raw weights, not their antisymmetric parametrization
+        Weights = (
+            self.parametrizations.Weights.original
+            if parametrize.is_parametrized(self, "Weights")
+            else self.Weights
+        )
 
-        # Calculate the degree of each node
-        deg = pyg_utils.degree(row, aggr_x.size()[0])
-        deg_inv_sqrt = deg.pow(-0.5)
+        # Reset parameters Kaiming takes into account activation function, Xavier does not.
+        # Each layer is initialized on its own, as a separate (n x n) matrix
+        for l in range(self.num_layers):
+            init.kaiming_uniform_(Weights[l], a=math.sqrt(5))
+            init.kaiming_uniform_(self.lin_weights[l], a=math.sqrt(5))
+        # fan_in = number of neurons in
+        bound = 1 / math.sqrt(self.hidden_dim)
+        init.uniform_(self.bias, -bound, bound)
 
-        # Formula 7 of paper, normalization
-        norm = deg_inv_sqrt[row] * deg_inv_sqrt[col]
+    def forward(self, x, A_hat):
+        # Read W of all layers once, the antisymmetric parametrization runs a single time
+        W = self.Weights
 
-        # Apply message passing by aggregating neighbors
-        aggr_x = self.propagate(edge_index, x=aggr_x, norm=norm)
+        for l in range(self.num_layers):
+            x_prev = x
 
-        x_prev = x
+            # Convolution of neighbors of previous layer PHI*(X(l-1), N_u), aggregated
+            # through the normalized adjacency precomputed by ADGN
+            aggr_x = torch.sparse.mm(A_hat, x_prev @ self.lin_weights[l])
 
-        # Apply the function of the paper
-        x = x_prev @ W + aggr_x + self.bias
-        x = self.epsilon * (self.act_func(x))
-        x = x_prev + x
+            # Apply the function of the paper, with the bias folded into the matmul
+            x = torch.addmm(self.bias[l], x_prev, W[l])
+            x.add_(aggr_x)
+            # Residual update of the paper, x_prev + epsilon * tanh(x) with the scale folded into the add
+            x = torch.add(x_prev, torch.tanh(x), alpha=self.epsilon)
 
         return x
 
-    def message(self, x_j, norm):
-        # Compute messages
-        # x_j has shape [E, outchannels]
-        return norm.view(-1, 1) * x_j
-
 
 class ADGN(nn.Module):
     def __init__(
@@ -136,6 +142,8 @@ class ADGN(nn.Module):
         hidden_dim,
         out_channels,
         num_layers,
+        edge_index,
+        num_nodes=None,
         epsilon=0.1,
         gamma=0.1,
         antisymmetric=True,
@@ -151,26 +159,28 @@ class ADGN(nn.Module):
         self.best_accuracy = -1
 
         # Embedding layer to reduce dimensionality of input to hidden_dim
-        self.emb = None
-        if self.hidden_dim is not None:
-            self.emb = nn.Linear(self.in_channels, self.hidden_dim, bias=False)
-
-        # Convolutional layers
-        self.conv = nn.ModuleList()
-
-        # Apply hidden dimensions in conv block
-        for _ in range(1, num_layers):
-            self.conv.append(
-                (
-                    ADGNConv(
-                        in_channels=self.hidden_dim,
-                        out_channels=self.hidden_dim,
-                    )
-                )
-            )
+        # Without hidden_dim the input is used as is, so forward has no branch
+        self.emb = (
+            nn.Linear(self.in_channels, self.hidden_dim, bias=False)
+            if self.hidden_dim is not None
+            else nn.Identity()
+        )
+        dim = self.hidden_dim if self.hidden_dim is not None else self.in_channels
+
+        # Convolutional layers, packed into a single stack with hidden dimensions
+        self.conv = ADGNStack(num_layers=num_layers - 1, hidden_dim=dim)
 
         # Output layer to map hidden_dim to out_channels
-        self.linear = nn.Linear(self.hidden_dim, self.out_channels)
+        self.linear = nn.Linear(dim, self.out_channels)
+
+        # Normalized adjacency with self loops of the static graph, built once here
+        if num_nodes is None:
+            num_nodes = int(edge_index.max()) + 1
+        self.num_nodes = num_nodes
+        self.num_edges = edge_index.size(1)
+        self.register_buffer(
+            "A_hat", build_sym_norm_csr(edge_index, num_nodes), persistent=False
+        )
 
     def forward(self, x):
         # Get node features and edge index
@@ -179,15 +189,22 @@ class ADGN(nn.Module):
             x.edge_index,
         )
 
-        emb = None
+        # Normalized adjacency shared by all convolutions, only valid for the construction graph
+        if x.size(0) != self.num_nodes or edge_idx.size(1) != self.num_edges:
+            raise ValueError(
+                "ADGN was built for a graph with {} nodes and {} edges, "
+                "got {} nodes and {} edges".format(
+                    self.num_nodes, self.num_edges, x.size(0), edge_idx.size(1)
+                )
+            )
+        A_hat = self.A_hat.to(x.dtype)
 
         # Apply embedding layer (Linear layer)
         x = self.emb(x)
 
-        # Apply convolutional layers called conv (ModuleList)
-        for conv in self.conv:
-            x = conv(x, edge_idx)
-            emb = x
+        # Apply convolutional layers called conv (ADGNStack)
+        x = self.conv(x, A_hat)
+        emb = x
 
         # Apply output layer (Linear layer)
         x = self.linear(x)
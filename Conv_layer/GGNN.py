@@ -14,7 +14,7 @@ import torch_geometric.transforms as T
 from torch_geometric.datasets import Planetoid, TUDataset
 from torch_geometric.data import DataLoader
 from torch_geometric.nn.inits import uniform
-from torch_geometric.nn.conv import MessagePassing
+from adjacency import build_csr
 from torch.nn import Parameter as Param
 from torch import Tensor
 from sklearn.manifold import TSNE
@@ -28,14 +28,13 @@ torch.manual_seed(42)
 
 # region Gated Graph Conv
 # BASE Class for information propagation and update amongst nodes
-class GatedGraphConv(MessagePassing):
+class GatedGraphConv(nn.Module):
 
-    def __init__(self, dataset, out_channels, num_layers, aggr="add", bias=True, **kwargs):
-        super(GatedGraphConv, self).__init__(aggr=aggr, **kwargs)
+    def __init__(self, out_channels, num_layers, bias=True):
+        super(GatedGraphConv, self).__init__()
 
         self.out_channels = out_channels
         self.num_layers = num_layers
-        self.data = dataset[0]
 
         self.rnn = torch.nn.GRUCell(self.out_channels, self.out_channels, bias=bias)
         self.weight = Param(
@@ -48,10 +47,7 @@ class GatedGraphConv(MessagePassing):
         uniform(self.out_channels, self.weight)
         self.rnn.reset_parameters()
 
-    def forward(self, x):
-
-        edge_index = self.data.edge_index
-        edge_weight = self.data.edge_attr
+    def forward(self, x, A_csr):
 
         if x.size(-1) > self.out_channels:
             raise ValueError(
@@ -68,7 +64,7 @@ class GatedGraphConv(MessagePassing):
             m = torch.matmul(x, self.weight[i])
 
             # Propagation model based on point 3.2 of paper
-            m = self.propagate(edge_index, x=m, edge_weight=edge_weight, size=None)
+            m = torch.sparse.mm(A_csr, m)
             x = self.rnn(m, x)
 
         return x
@@ -134,19 +130,24 @@ class GGNN(torch.nn.Module):
             print("mismatch, operating a reduction")
             self.emb = nn.Linear(in_channels, hidden_dim, bias=False)
 
-        self.conv = GatedGraphConv(dataset=dataset, out_channels=out_channels, num_layers=num_conv)
+        self.conv = GatedGraphConv(out_channels=out_channels, num_layers=num_conv)
 
         self.mlp = MLP(input_dim=out_channels, hid_dims=[mlp_hdim] * mlp_hlayers)
 
         self.out_layer = nn.Linear(mlp_hdim, dataset.num_classes)
 
+        # Sum aggregation adjacency as a sparse CSR matrix, built once for the static graph
+        data = dataset[0]
+        A = build_csr(data.edge_index, data.num_nodes)
+        self.register_buffer("A_csr", A, persistent=False)
+
     def forward(self, data):
 
         # Linear Encoding / Feature Reduction
         x = self.emb(data.x)
 
         # Propagation and GRU
-        x = self.conv(x)
+        x = self.conv(x, self.A_csr)
 
         # MLP
         x = self.mlp(x)
@@ -154,5 +155,5 @@ class GGNN(torch.nn.Module):
         # Linear Decoding
         x_emb = self.out_layer(x)
 
-        # Prediction
-        return x_emb, F.log_softmax(x_emb, dim=-1)
+        # Prediction, raw logits since CrossEntropyLoss applies log_softmax itself
+        return x_emb, x_emb
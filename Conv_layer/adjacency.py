@@ -0,0 +1,41 @@
+import torch
+
+
+# Sparse CSR adjacency where each target node (row) sums over its sources (col),
+# with unit weight unless values are given
+def build_csr(edge_index, num_nodes, values=None, device=None):
+    if device is not None:
+        edge_index = edge_index.to(device)
+    if values is None:
+        values = torch.ones(edge_index.size(1), device=edge_index.device)
+
+    A = torch.sparse_coo_tensor(
+        edge_index.flip(0), values.to(edge_index.device), (num_nodes, num_nodes)
+    )
+    A = A.coalesce().to_sparse_csr()
+
+    # int32 indices halve the index traffic of the memory bound SpMM
+    return torch.sparse_csr_tensor(
+        A.crow_indices().int(), A.col_indices().int(), A.values(), A.size()
+    )
+
+
+# Symmetrically normalized CSR adjacency with self loops (formula 7 of the A-DGN paper),
+# computed once for a static graph with plain torch ops
+def build_sym_norm_csr(edge_index, num_nodes, device=None):
+    if device is not None:
+        edge_index = edge_index.to(device)
+
+    # Add self loops to edge index and split into row and col
+    loop = torch.arange(num_nodes, device=edge_index.device)
+    edge_index = torch.cat([edge_index, torch.stack([loop, loop])], dim=1)
+    row, col = edge_index
+
+    # Compute the degree of each node
+    deg = torch.bincount(row, minlength=num_nodes).float()
+    deg_inv_sqrt = deg.pow(-0.5)
+
+    # Normalization
+    norm = deg_inv_sqrt[row] * deg_inv_sqrt[col]
+
+    return build_csr(edge_index, num_nodes, norm)
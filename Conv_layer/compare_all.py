@@ -2,6 +2,7 @@ from ADGN_Message import ADGN
 from GCN import GCN
 from GAT import GAT
 from GGNN import GGNN
+from train_utils import build_adam
 
 import numpy as np
 from datetime import datetime
@@ -53,7 +54,7 @@ def train(dataset, conv_layer, writer, epochs, model, lr, hidden_layer, loss_fun
 
     # Build model
     # model = GCN(max(dataset.num_node_features, 1), hidden_layer, dataset.num_classes, conv_layers=conv_layer)
-    opt = optim.Adam(model.parameters(), lr=lr)
+    opt = build_adam(model, lr=lr)
 
     loss_fn = loss_func
 
@@ -78,7 +79,7 @@ def train(dataset, conv_layer, writer, epochs, model, lr, hidden_layer, loss_fun
 
         for batch in loader:
             # breakpoint()
-            opt.zero_grad()
+            opt.zero_grad(set_to_none=True)
             embedding, pred = model(batch)
             label = batch.y
 
@@ -191,6 +192,8 @@ def conv():
                             dataset.num_classes,
                             num_layers=conv,
                             antisymmetric=True,
+                            edge_index=dataset[0].edge_index,
+                            num_nodes=dataset[0].num_nodes,
                         )
                     elif m == "ADGNF":
                         loss_fn = nn.CrossEntropyLoss()
@@ -200,6 +203,8 @@ def conv():
                             dataset.num_classes,
                             num_layers=conv,
                             antisymmetric=False,
+                            edge_index=dataset[0].edge_index,
+                            num_nodes=dataset[0].num_nodes,
                         )
                     # H
                     elif m == "GAT":
@@ -0,0 +1,9 @@
+import torch
+
+
+# Adam with the fused kernel on CUDA and the multi-tensor (foreach) update on CPU
+def build_adam(model, lr):
+    use_fused = next(model.parameters()).is_cuda
+    return torch.optim.Adam(
+        model.parameters(), lr=lr, fused=use_fused, foreach=not use_fused
+    )
@@ -4,24 +4,18 @@
 # !pip install torch-geometric
 # !pip install tensorboardX
 
+import math
 import numpy as np
 import torch
 import torch.optim as optim
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn.init as init
+from torch.nn.utils import parametrize
 
 # Visualization
 from datetime import datetime
 
-# nn module for Neural Network model
-# Implement graph conv, gene conf etc.
-import torch_geometric.nn as pyg_nn
-
-# Performs some graph utlity functions
-import torch_geometric.utils as pyg_utils
-from torch_geometric.utils import add_self_loops, degree
-
 # For graph visualization
 import networkx as nx
 import torch_geometric.transforms as T
@@ -30,7 +24,6 @@ import torch_geometric.transforms as T
 from tensorboardX import SummaryWriter
 
 # to get node embeddings into 2d representation
-from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
 
 # Datasets we will use
@@ -44,92 +37,105 @@ import sys
 from time import time
 import psutil
 from compstats import computeStats
+from train_utils import build_adam, tsne_2d
+from adjacency import build_sym_norm_csr
 
 torch.manual_seed(42)
 np.random.seed(42)
 
 
-class ADGNConv(pyg_nn.MessagePassing):
+class Antisymmetric(nn.Module):
+    def __init__(self, gamma: float = 0.1):
+        super(Antisymmetric, self).__init__()
+
+        self.gamma = gamma
+
+    def forward(self, W):
+        # Antisymmetric formulation (paper formula 5) for a stack of (n x n) weights, gamma * I
+        # is subtracted from the diagonals in place instead of building an identity matrix
+        W = W - W.transpose(-1, -2)
+        W.diagonal(dim1=-2, dim2=-1).sub_(self.gamma)
+        return W
+
+
+class ADGNStack(nn.Module):
     def __init__(
         self,
-        in_channels: int,
-        out_channels: int,
+        num_layers: int,
+        hidden_dim: int,
         gamma: float = 0.1,
         epsilon: float = 0.1,
         antisymmetry=True,
     ):
-        super(ADGNConv, self).__init__(
-            aggr="add"
-        )  # "Add" aggregation (can alternatively use mean or max)
+        super(ADGNStack, self).__init__()
 
-        self.in_channels = in_channels
-        self.out_channels = out_channels
+        self.num_layers = num_layers
+        self.hidden_dim = hidden_dim
         self.gamma = gamma
         self.epsilon = epsilon
-        self.act_func = nn.Tanh()
         self.antisymmetry = antisymmetry
-        self.best_accuracy = -1
 
-        # Defines learnable weighs and biases, where W has (nxn) and bias is (n)
+        # Learnable weights and biases of all layers packed together, W is (L x n x n) and bias is (L x n)
         self.Weights = nn.Parameter(
-            torch.zeros((self.in_channels, self.in_channels)), requires_grad=True
+            torch.empty((self.num_layers, self.hidden_dim, self.hidden_dim)),
+            requires_grad=True,
         )
         # As presented in the paper, bias is always learned from the depiction, thus we always set bias
-        self.bias = nn.Parameter(torch.zeros((self.in_channels)), requires_grad=True)
-        # Identity as per formula of paper
-        self.Identity = nn.Parameter(torch.eye(self.in_channels), requires_grad=False)
-
-        # Aggregation function NEVER has learnable parameters
-        self.linear = nn.Linear(self.in_channels, self.out_channels, bias=False)
-
-        # Reset parameters Kaiming takes into account activation function, Xavier does not
-        init.kaiming_uniform(self.Weights, np.sqrt(5))
-        # fan_in and fan_out = number of neurons in and number of neurons out
-        fan_in, _ = init._calculate_fan_in_and_fan_out(self.Weights)
-        bound = np.clip(1 / np.sqrt(fan_in), 0, np.inf)
-        init.uniform_(self.bias, -bound, bound)
-        self.linear.reset_parameters()
+        self.bias = nn.Parameter(
+            torch.empty((self.num_layers, self.hidden_dim)), requires_grad=True
+        )
 
-    def forward(self, x, edge_index):
-        # Antisymmetric formulation (paper formula 5)
-        W = (
-            ((self.Weights - self.Weights.T) - (self.gamma * self.Identity))
-            if self.antisymmetry
-            else self.Weights
+        # Aggregation function weights (L x n x n), NEVER has a bias
+        self.lin_weights = nn.Parameter(
+            torch.empty((self.num_layers, self.hidden_dim, self.hidden_dim)),
+            requires_grad=True,
         )
 
-        # Convolution of neighbors of previous layer PHI*(X(l-1), N_u)
-        # Do forward pass for backpropp to learn weights of Linear Layer
-        aggr_x = self.linear(x)
+        self.reset_parameters()
 
-        # Add self loops to edge index and split into row and col
-        edge_index, _ = add_self_loops(edge_index, num_nodes=x.size(0))
-        row, col = edge_index
+        # W is parametrized as antisymmetric, the transform runs once per forward
+        # on the packed weights of all layers
+        if self.antisymmetry:
+            parametrize.register_parametrization(
+                self, "Weights", Antisymmetric(self.gamma)
+            )
+
+    def reset_parameters(self):
+        # Initialize the raw weights, not their antisymmetric parametrization
+        Weights = (
+            self.parametrizations.Weights.original
+            if parametrize.is_parametrized(self, "Weights")
+            else self.Weights
+        )
 
-        # Compute the degree of each node
-        deg = pyg_utils.degree(row, aggr_x.size()[0])
-        deg_inv_sqrt = deg.pow(-0.5)
+        # Reset parameters Kaiming takes into account activation function, Xavier does not.
+        # Each layer is initialized on its own, as a separate (n x n) matrix
+        for l in range(self.num_layers):
+            init.kaiming_uniform_(Weights[l], a=math.sqrt(5))
+            init.kaiming_uniform_(self.lin_weights[l], a=math.sqrt(5))
+        # fan_in = number of neurons in
+        bound = 1 / math.sqrt(self.hidden_dim)
+        init.uniform_(self.bias, -bound, bound)
 
-        # Formula 7 of paper, normalization
-        norm = deg_inv_sqrt[row] * deg_inv_sqrt[col]
+    def forward(self, x, A_hat):
+        # Read W of all layers once, the antisymmetric parametrization runs a single time
+        W = self.Weights
 
-        # Propagate messages via aggregation function
-        aggr_x = self.propagate(edge_index, x=aggr_x, norm=norm)
+        for l in range(self.num_layers):
+            x_prev = x
 
-        x_prev = x
+            # Convolution of neighbors of previous layer PHI*(X(l-1), N_u), aggregated
+            # through the normalized adjacency precomputed by ADGN
+            aggr_x = torch.sparse.mm(A_hat, x_prev @ self.lin_weights[l])
 
-        # Apply function of paper in the forward pass
-        x = x_prev @ W + aggr_x + self.bias
-        x = self.epsilon * (self.act_func(x))
-        x = x_prev + x
+            # Apply the function of the paper, with the bias folded into the matmul
+            x = torch.addmm(self.bias[l], x_prev, W[l])
+            x.add_(aggr_x)
+            # Residual update of the paper, x_prev + epsilon * tanh(x) with the scale folded into the add
+            x = torch.add(x_prev, torch.tanh(x), alpha=self.epsilon)
 
         return x
 
-    def message(self, x_j, norm):
-        # Compute messages
-        # x_j has shape [E, outchannels]
-        return norm.view(-1, 1) * x_j
-
 
 class ADGN(nn.Module):
     def __init__(
@@ -138,6 +144,8 @@ class ADGN(nn.Module):
         hidden_dim,
         out_channels,
         num_layers,
+        edge_index,
+        num_nodes=None,
         epsilon=0.1,
         gamma=0.1,
         antisymmetry=True,
@@ -152,27 +160,32 @@ class ADGN(nn.Module):
         self.antisymmetry = antisymmetry
 
         # Linear layer for embedding from input to hidden dimension
-        self.emb = None
-        if self.hidden_dim is not None:
-            self.emb = nn.Linear(self.in_channels, self.hidden_dim, bias=False)
-
-        # Module list for convolutions
-        self.conv = nn.ModuleList()
-
-        # Apply hidden dimensions in conv block
-        for _ in range(1, num_layers):
-            self.conv.append(
-                (
-                    ADGNConv(
-                        in_channels=self.hidden_dim,
-                        out_channels=self.hidden_dim,
-                        antisymmetry=self.antisymmetry,
-                    )
-                )
-            )
+        # Without hidden_dim the input is used as is, so forward has no branch
+        self.emb = (
+            nn.Linear(self.in_channels, self.hidden_dim, bias=False)
+            if self.hidden_dim is not None
+            else nn.Identity()
+        )
+        dim = self.hidden_dim if self.hidden_dim is not None else self.in_channels
+
+        # Stack of convolutions with hidden dimensions
+        self.conv = ADGNStack(
+            num_layers=num_layers - 1,
+            hidden_dim=dim,
+            antisymmetry=self.antisymmetry,
+        )
 
         # Linear layer for final output from hidden to output dimension
-        self.linear = nn.Linear(self.hidden_dim, self.out_channels)
+        self.linear = nn.Linear(dim, self.out_channels)
+
+        # Normalized adjacency with self loops of the static graph, built once here
+        if num_nodes is None:
+            num_nodes = int(edge_index.max()) + 1
+        self.num_nodes = num_nodes
+        self.num_edges = edge_index.size(1)
+        self.register_buffer(
+            "A_hat", build_sym_norm_csr(edge_index, num_nodes), persistent=False
+        )
 
     def forward(self, x):
 
@@ -182,13 +195,22 @@ class ADGN(nn.Module):
             x.edge_index,
         )
 
+        # Normalized adjacency shared by all convolutions, only valid for the construction graph
+        if x.size(0) != self.num_nodes or edge_idx.size(1) != self.num_edges:
+            raise ValueError(
+                "ADGN was built for a graph with {} nodes and {} edges, "
+                "got {} nodes and {} edges".format(
+                    self.num_nodes, self.num_edges, x.size(0), edge_idx.size(1)
+                )
+            )
+        A_hat = self.A_hat.to(x.dtype)
+
         # Apply linear layer for embedding
         x = self.emb(x)
 
         # Apply convolutions
-        for conv in self.conv:
-            x = conv(x, edge_idx)
-            emb = x
+        x = self.conv(x, A_hat)
+        emb = x
 
         # Apply final linear layer
         x = self.linear(x)
@@ -200,22 +222,17 @@ class ADGN(nn.Module):
 def visualization_nodembs(dataset, model):
 
     color_list = ["red", "orange", "green", "blue", "purple", "brown", "black"]
-    loader = DataLoader(dataset, batch_size=1, shuffle=False)
-
-    embs = []
-    colors = []
-
-    for batch in loader:
 
-        emb, pred = model(batch)
-        embs.append(emb)
+    # Planetoid holds a single graph, so one forward pass embeds every node
+    data = dataset[0]
+    emb, pred = model(data)
 
-        colors += [color_list[y] for y in batch.y]
+    colors = [color_list[y] for y in data.y.tolist()]
 
-    embs = torch.cat(embs, dim=0)
+    X = emb.detach().cpu().numpy()
 
-    # Get 2D representation of embeddings
-    xs, ys = zip(*TSNE(random_state=42).fit_transform(embs.detach().numpy()))
+    # Get the 2D representation of the embeddings
+    xs, ys = zip(*tsne_2d(X))
 
     # Plot the 2D representation
     plt.scatter(xs, ys, color=colors)
@@ -226,7 +243,9 @@ def visualization_nodembs(dataset, model):
 
 
 # Train the model
-def train(dataset, conv_layer, hidden_dim, writer, epochs, antisymmetry=True):
+def train(
+    dataset, conv_layer, hidden_dim, writer, epochs, antisymmetry=True, compile_model=False
+):
 
     test_loader = loader = DataLoader(dataset, batch_size=1, shuffle=True)
 
@@ -238,9 +257,14 @@ def train(dataset, conv_layer, hidden_dim, writer, epochs, antisymmetry=True):
         dataset.num_classes,
         num_layers=conv_layer,
         antisymmetry=antisymmetry,
+        edge_index=dataset[0].edge_index,
+        num_nodes=dataset[0].num_nodes,
     )
 
-    opt = optim.Adam(model.parameters(), lr=0.01)
+    if compile_model:
+        model = torch.compile(model, dynamic=False)
+
+    opt = build_adam(model, lr=0.01)
     loss_fn = nn.CrossEntropyLoss()
 
     test_accuracies = []
@@ -251,15 +275,13 @@ def train(dataset, conv_layer, hidden_dim, writer, epochs, antisymmetry=True):
     
     requirements = {}
 
-    # Reimport Dictionary to resume execution
+    # Start from an empty dictionary, only every 10th epoch is sampled so
+    # resuming would keep the other epochs of an older run in the file
     #file_path = os.path.join(os.path.pardir, "ADGN_Message.py_requirements.json")
     file_path = 'Train/comp_per_model/ADGN_Message.py_requirements.json'
     if os.path.exists(file_path):
-        print("[WARNING]\n Importing an already existing json file for the requirements dictionary")
+        print("[WARNING]\n Overwriting the already existing json file for the requirements dictionary")
         print(file_path)
-        # Open the file and load the data
-        with open(file_path, 'r') as file:
-            requirements = json.load(file)
     else:
         print(current_filename)
         current_filename + "_requirements.json"
@@ -288,12 +310,13 @@ def train(dataset, conv_layer, hidden_dim, writer, epochs, antisymmetry=True):
         model.train()
         
         
-        # For CPU/GPU UILITZATION
-        computeStats(start_time, epoch, current_process, num_cpus, requirements)
+        # For CPU/GPU UILITZATION, sampled every 10 epochs to keep it off the hot path
+        if epoch % 10 == 0:
+            computeStats(start_time, epoch, current_process, num_cpus, requirements)
 
         for batch in loader:
 
-            opt.zero_grad()
+            opt.zero_grad(set_to_none=True)
 
             emb, pred = model(batch)
 
@@ -309,11 +332,11 @@ def train(dataset, conv_layer, hidden_dim, writer, epochs, antisymmetry=True):
 
             opt.step()
 
-            # Accumulate the loss
-            total_loss += loss.item() * batch.num_graphs
+            # Accumulate the loss on device, without a sync per batch
+            total_loss = total_loss + loss.detach() * batch.num_graphs
 
         # Average loss
-        total_loss /= len(loader.dataset)
+        total_loss = float(total_loss) / len(loader.dataset)
 
         # Write the loss to tensorboard
         writer.add_scalar("Loss", total_loss, epoch)
@@ -379,6 +402,7 @@ parser.add_argument("--epoch", type=int, help="Epoch Amount", default=100)
 parser.add_argument("--conv", type=int, help="Conv Amount", default=3)
 parser.add_argument("--hidden", type=int, help="Hidden Layer", default=32)
 parser.add_argument("--asym", type=bool, help="Use AntiSymmetric Weights", default=1)
+parser.add_argument("--compile", action="store_true", help="Compile the model with torch.compile")
 
 if __name__ == "__main__":
 
@@ -394,7 +418,13 @@ if __name__ == "__main__":
     hidden_dim = args.hidden
     antisymmetry = True if args.asym == 1 else False
     model = train(
-        dataset, conv_layer, hidden_dim, writer, epochs, antisymmetry=True
+        dataset,
+        conv_layer,
+        hidden_dim,
+        writer,
+        epochs,
+        antisymmetry=True,
+        compile_model=args.compile,
     )
 
     # Visualize the node embeddings
@@ -57,6 +57,7 @@ import sys
 from time import time
 import psutil
 from compstats import computeStats
+from train_utils import build_adam
 
 import argparse
 
@@ -133,7 +134,7 @@ def train(dataset, hidden_dim, writer, epochs, heads):
     # input_dim, output_dim, hidden_dim, num_heads
     model = GAT(dataset.num_node_features, dataset.num_classes, hidden_dim, heads)
 
-    opt = optim.Adam(model.parameters(), lr=0.003)
+    opt = build_adam(model, lr=0.003)
     loss_fn = nn.NLLLoss()
 
     test_accuracies = []
@@ -143,15 +144,13 @@ def train(dataset, hidden_dim, writer, epochs, heads):
     
     requirements = {}
 
-    # Reimport Dictionary to resume execution
+    # Start from an empty dictionary, only every 10th epoch is sampled so
+    # resuming would keep the other epochs of an older run in the file
     #file_path = os.path.join(os.path.pardir, "ADGN_Message.py_requirements.json")
     file_path = 'Train/comp_per_model/GAT.py_requirements.json'
     if os.path.exists(file_path):
-        print("[WARNING]\n Importing an already existing json file for the requirements dictionary")
+        print("[WARNING]\n Overwriting the already existing json file for the requirements dictionary")
         print(file_path)
-        # Open the file and load the data
-        with open(file_path, 'r') as file:
-            requirements = json.load(file)
     else:
         print(current_filename)
         current_filename + "_requirements.json"
@@ -177,12 +176,13 @@ def train(dataset, hidden_dim, writer, epochs, heads):
         total_loss = 0
         model.train()
         
-        # For CPU/GPU UILITZATION
-        computeStats(start_time, epoch, current_process, num_cpus, requirements)
+        # For CPU/GPU UILITZATION, sampled every 10 epochs like the other models
+        if epoch % 10 == 0:
+            computeStats(start_time, epoch, current_process, num_cpus, requirements)
 
         for batch in loader:
 
-            opt.zero_grad()
+            opt.zero_grad(set_to_none=True)
 
             emb, pred = model(batch)
             label = batch.y
@@ -197,10 +197,10 @@ def train(dataset, hidden_dim, writer, epochs, heads):
 
             opt.step()
 
-            # Accumulate the loss
-            total_loss += loss.item() * batch.num_graphs
+            # Accumulate the loss on device, without a sync per batch
+            total_loss = total_loss + loss.detach() * batch.num_graphs
 
-        total_loss /= len(loader.dataset)
+        total_loss = float(total_loss) / len(loader.dataset)
 
         # Write the loss to tensorboard
         writer.add_scalar("Loss", total_loss, epoch)
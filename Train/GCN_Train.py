@@ -28,7 +28,6 @@ import torch_geometric.transforms as T
 from tensorboardX import SummaryWriter
 
 # to get node embeddings into 2d representation
-from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
 
 # Datasets we will use
@@ -44,6 +43,7 @@ import sys
 from time import time
 import psutil
 from compstats import computeStats
+from train_utils import build_adam, tsne_2d
 
 
 class GCN(nn.Module):
@@ -116,7 +116,7 @@ class GCN(nn.Module):
 
 
 # Train the model
-def train(dataset, conv_layer, writer, epochs):
+def train(dataset, conv_layer, writer, epochs, compile_model=False):
 
     test_loader = loader = DataLoader(dataset, batch_size=64, shuffle=True)
 
@@ -128,7 +128,10 @@ def train(dataset, conv_layer, writer, epochs):
         conv_layers=conv_layer,
     )
 
-    opt = optim.Adam(model.parameters(), lr=0.01)
+    if compile_model:
+        model = torch.compile(model, dynamic=False)
+
+    opt = build_adam(model, lr=0.01)
     test_accuracies = []
     
     
@@ -137,15 +140,13 @@ def train(dataset, conv_layer, writer, epochs):
     
     requirements = {}
 
-    # Reimport Dictionary to resume execution
+    # Start from an empty dictionary, only every 10th epoch is sampled so
+    # resuming would keep the other epochs of an older run in the file
     #file_path = os.path.join(os.path.pardir, "ADGN_Message.py_requirements.json")
     file_path = 'Train/comp_per_model/GCN.py_requirements.json'
     if os.path.exists(file_path):
-        print("[WARNING]\n Importing an already existing json file for the requirements dictionary")
+        print("[WARNING]\n Overwriting the already existing json file for the requirements dictionary")
         print(file_path)
-        # Open the file and load the data
-        with open(file_path, 'r') as file:
-            requirements = json.load(file)
     else:
         print(current_filename)
         current_filename + "_requirements.json"
@@ -177,12 +178,13 @@ def train(dataset, conv_layer, writer, epochs):
         total_loss = 0
         model.train()
 
-        # For CPU/GPU UILITZATION
-        computeStats(start_time, epoch, current_process, num_cpus, requirements)
+        # For CPU/GPU UILITZATION, sampled every 10 epochs to keep it off the hot path
+        if epoch % 10 == 0:
+            computeStats(start_time, epoch, current_process, num_cpus, requirements)
         
         for batch in loader:
 
-            opt.zero_grad()
+            opt.zero_grad(set_to_none=True)
 
             embedding, pred = model(batch)
 
@@ -198,11 +200,11 @@ def train(dataset, conv_layer, writer, epochs):
 
             opt.step()
 
-            # Accumulate the loss
-            total_loss += loss.item() * batch.num_graphs
+            # Accumulate the loss on device, without a sync per batch
+            total_loss = total_loss + loss.detach() * batch.num_graphs
 
         # Average loss
-        total_loss /= len(loader.dataset)
+        total_loss = float(total_loss) / len(loader.dataset)
 
         # Write the loss to tensorboard
         writer.add_scalar("Loss", total_loss, epoch)
@@ -263,23 +265,17 @@ def test(loader, model, is_validation=False):
 def visualization_nodembs(dataset, model):
 
     color_list = ["red", "orange", "green", "blue", "purple", "brown", "black"]
-    loader = DataLoader(dataset, batch_size=64, shuffle=True)
-
-    embs = []
-    colors = []
-
-    for batch in loader:
-
-        emb, pred = model(batch)
 
-        embs.append(emb)
+    # Planetoid holds a single graph, so one forward pass embeds every node
+    data = dataset[0]
+    emb, pred = model(data)
 
-        colors += [color_list[y] for y in batch.y]
+    colors = [color_list[y] for y in data.y.tolist()]
 
-    embs = torch.cat(embs, dim=0)
+    X = emb.detach().cpu().numpy()
 
     # Get the 2D representation of the embeddings
-    xs, ys = zip(*TSNE().fit_transform(embs.detach().numpy()))
+    xs, ys = zip(*tsne_2d(X))
 
     # Plot the 2D representation
     plt.scatter(xs, ys, color=colors)
@@ -295,6 +291,7 @@ import argparse
 parser = argparse.ArgumentParser(description="Process some inputs.")
 parser.add_argument("--epoch", type=int, help="Epoch Amount", default=100)
 parser.add_argument("--conv", type=int, help="Conv Amount", default=3)
+parser.add_argument("--compile", action="store_true", help="Compile the model with torch.compile")
 
 if __name__ == "__main__":
 
@@ -304,5 +301,5 @@ if __name__ == "__main__":
     dataset = Planetoid(root="/tmp/PubMed", name="PubMed")
     conv_layer = args.conv
     epochs = args.epoch
-    model = train(dataset, conv_layer, writer, epochs)
+    model = train(dataset, conv_layer, writer, epochs, compile_model=args.compile)
     visualization_nodembs(dataset, model)
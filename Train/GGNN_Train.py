@@ -12,12 +12,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch_geometric.transforms as T
 from torch_geometric.datasets import Planetoid, TUDataset
-from torch_geometric.data import DataLoader
 from torch_geometric.nn.inits import uniform
-from torch_geometric.nn.conv import MessagePassing
 from torch.nn import Parameter as Param
 from torch import Tensor
-from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
 import numpy as np
 from datetime import datetime
@@ -29,6 +26,8 @@ import sys
 from time import time
 import psutil
 from compstats import computeStats
+from train_utils import build_adam, tsne_2d
+from adjacency import build_csr
 
 
 torch.manual_seed(42)
@@ -36,10 +35,10 @@ torch.manual_seed(42)
 
 # region Gated Graph Conv
 # BASE Class for information propagation and update amongst nodes
-class GatedGraphConv(MessagePassing):
+class GatedGraphConv(nn.Module):
 
-    def __init__(self, out_channels, num_layers, aggr="add", bias=True, **kwargs):
-        super(GatedGraphConv, self).__init__(aggr=aggr, **kwargs)
+    def __init__(self, out_channels, num_layers, bias=True):
+        super(GatedGraphConv, self).__init__()
 
         self.out_channels = out_channels
         self.num_layers = num_layers
@@ -55,10 +54,7 @@ class GatedGraphConv(MessagePassing):
         uniform(self.out_channels, self.weight)
         self.rnn.reset_parameters()
 
-    def forward(self, x):
-
-        edge_index = data.edge_index
-        edge_weight = data.edge_attr
+    def forward(self, x, A_csr):
 
         if x.size(-1) > self.out_channels:
             raise ValueError(
@@ -74,8 +70,9 @@ class GatedGraphConv(MessagePassing):
         for i in range(self.num_layers):
             m = torch.matmul(x, self.weight[i])
 
-            # Propagation model based on point 3.2 of paper
-            m = self.propagate(edge_index, x=m, edge_weight=edge_weight, size=None)
+            # Propagation model based on point 3.2 of paper, run in the adjacency dtype
+            # (the casts are no-ops unless the adjacency was kept fp32 on CPU)
+            m = torch.sparse.mm(A_csr, m.to(A_csr.dtype)).to(x.dtype)
             x = self.rnn(m, x)
 
         return x
@@ -121,6 +118,7 @@ class GGNN(torch.nn.Module):
     def __init__(
         self,
         in_channels,
+        dataset,
         out_channels=None,
         num_conv=3,
         hidden_dim=32,
@@ -145,13 +143,18 @@ class GGNN(torch.nn.Module):
 
         self.out_layer = nn.Linear(mlp_hdim, dataset.num_classes)
 
+        # Sum aggregation adjacency as a sparse CSR matrix, built once for the static graph
+        data = dataset[0]
+        A = build_csr(data.edge_index, data.num_nodes)
+        self.register_buffer("A_csr", A, persistent=False)
+
     def forward(self, data):
 
         # Linear Encoding / Feature Reduction
         x = self.emb(data.x)
 
         # Propagation and GRU
-        x = self.conv(x)
+        x = self.conv(x, self.A_csr)
 
         # MLP
         x = self.mlp(x)
@@ -159,8 +162,8 @@ class GGNN(torch.nn.Module):
         # Linear Decoding
         x_emb = self.out_layer(x)
 
-        # Prediction
-        return x_emb, F.log_softmax(x_emb, dim=-1)
+        # Prediction, raw logits since CrossEntropyLoss applies log_softmax itself
+        return x_emb, x_emb
 
 
 # endregion
@@ -168,16 +171,33 @@ class GGNN(torch.nn.Module):
 # region Training
 
 
-def train(dataset, epochs=100, num_conv=3, learning_rate=0.001):
+def train(
+    dataset, epochs=100, num_conv=3, learning_rate=0.001, compile_model=False, bf16=False
+):
     ###### SETUP ######
     start_time = time()
-    test_loader = loader = DataLoader(dataset, batch_size=1, shuffle=True)
+    # Planetoid holds a single graph, move it to the device once
+    data = dataset[0].to(device)
     model = GGNN(
-        in_channels=dataset.x.shape[-1], out_channels=32, num_conv=num_conv
+        in_channels=dataset.x.shape[-1],
+        dataset=dataset,
+        out_channels=32,
+        num_conv=num_conv,
     ).to(device)
-    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+
+    # Half precision features and weights, labels and masks stay int64
+    if bf16:
+        model = model.to(torch.bfloat16)
+        data.x = data.x.to(torch.bfloat16)
+        # CPU sparse matmul has no bfloat16 kernel, so there the adjacency stays fp32
+        if not model.A_csr.is_cuda:
+            model.A_csr = model.A_csr.float()
+
+    if compile_model:
+        model = torch.compile(model, dynamic=False)
+
+    optimizer = build_adam(model, lr=learning_rate)
     loss_fn = nn.CrossEntropyLoss()
-    tot_loss = 0
     best_acc = [0, 0, 0]
     
     # For CPU/GPU UILITZATION
@@ -185,15 +205,13 @@ def train(dataset, epochs=100, num_conv=3, learning_rate=0.001):
     
     requirements = {}
 
-    # Reimport Dictionary to resume execution
+    # Start from an empty dictionary, only every 10th epoch is sampled so
+    # resuming would keep the other epochs of an older run in the file
     #file_path = os.path.join(os.path.pardir, "ADGN_Message.py_requirements.json")
     file_path = 'Train/comp_per_model/GGNN.py_requirements.json'
     if os.path.exists(file_path):
-        print("[WARNING]\n Importing an already existing json file for the requirements dictionary")
+        print("[WARNING]\n Overwriting the already existing json file for the requirements dictionary")
         print(file_path)
-        # Open the file and load the data
-        with open(file_path, 'r') as file:
-            requirements = json.load(file)
     else:
         print(current_filename)
         current_filename + "_requirements.json"
@@ -224,56 +242,52 @@ def train(dataset, epochs=100, num_conv=3, learning_rate=0.001):
         epoch_start_time = datetime.now()
         model.train()
         
-        # For CPU/GPU UILITZATION
-        computeStats(start_time, epoch-1, current_process, num_cpus, requirements)
-
-        for batch in loader:
-            optimizer.zero_grad()
+        # For CPU/GPU UILITZATION, sampled every 10 epochs to keep it off the hot path
+        if (epoch - 1) % 10 == 0:
+            computeStats(start_time, epoch - 1, current_process, num_cpus, requirements)
 
-            # Forward pass
-            emb_x, pred = model(batch)
+        optimizer.zero_grad(set_to_none=True)
 
-            # extract prediction and label
-            pred = pred[batch.train_mask]
-            label = batch.y[batch.train_mask]
+        # Forward pass
+        emb_x, pred = model(data)
 
-            loss = loss_fn(pred, label)
-            loss_fn(pred, label).backward()
+        # extract prediction and label
+        pred = pred[data.train_mask]
+        label = data.y[data.train_mask]
 
-            optimizer.step()
-            tot_loss += loss.item()
+        loss = loss_fn(pred, label)
+        loss.backward()
 
-        tot_loss /= len(loader.dataset)
+        optimizer.step()
         ###
 
         ### Test
         if epoch % 10 == 0:
             model.eval()
-            for data in test_loader:
-                with torch.no_grad():
-                    accs = []
-                    # Forward pass
-                    emb, logits = model(data)
-                    masks = [data.train_mask, data.val_mask, data.test_mask]
-                    for mask in masks:
+            with torch.no_grad():
+                accs = []
+                # Forward pass
+                emb, logits = model(data)
+                masks = [data.train_mask, data.val_mask, data.test_mask]
+                for mask in masks:
 
-                        # Obtain most likely class
-                        pred = logits[mask].max(1)[1]
+                    # Obtain most likely class
+                    pred = logits[mask].max(1)[1]
 
-                        # Compute accuracy
-                        acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
-                        accs.append(acc)
+                    # Compute accuracy
+                    acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
+                    accs.append(acc)
 
-                # Collecting and computing best accuracies for each set
-                train_acc = accs[0]
-                val_acc = accs[1]
-                test_acc = accs[2]
+            # Collecting and computing best accuracies for each set
+            train_acc = accs[0]
+            val_acc = accs[1]
+            test_acc = accs[2]
 
-                best_acc[0] = max(best_acc[0], train_acc)
-                best_acc[1] = max(best_acc[1], val_acc)
-                best_acc[2] = max(best_acc[2], test_acc)
+            best_acc[0] = max(best_acc[0], train_acc)
+            best_acc[1] = max(best_acc[1], val_acc)
+            best_acc[2] = max(best_acc[2], test_acc)
 
-                model.best_acc = best_acc[2]
+            model.best_acc = best_acc[2]
 
             print(
                 "Epoch: {:03d}, Train Acc: {:.0%}, "
@@ -302,20 +316,19 @@ def train(dataset, epochs=100, num_conv=3, learning_rate=0.001):
 # region Visualisation
 def visualization_nodembs(dataset, model):
     color_list = ["red", "orange", "green", "blue", "purple", "brown", "black"]
-    loader = DataLoader(dataset, batch_size=1, shuffle=False)
-    embs = []
-    colors = []
 
-    for batch in loader:
-        print("batch is", batch)
-        emb, pred = model(batch)
-        embs.append(emb)
+    # Planetoid holds a single graph, so one forward pass embeds every node
+    data = dataset[0].to(device)
+    # Match the precision the model was trained with
+    data.x = data.x.to(model.out_layer.weight.dtype)
+    emb, pred = model(data)
+
+    colors = [color_list[y] for y in data.y.tolist()]
 
-        colors += [color_list[y] for y in batch.y]
-    embs = torch.cat(embs, dim=0)
+    X = emb.detach().float().cpu().numpy()
 
     # Get the 2D representation of the embeddings
-    xs, ys = zip(*TSNE(random_state=42).fit_transform(embs.detach().numpy()))
+    xs, ys = zip(*tsne_2d(X))
 
     # Plot the 2D representation
     plt.scatter(xs, ys, color=colors)
@@ -333,6 +346,8 @@ import argparse
 parser = argparse.ArgumentParser(description="Process some inputs.")
 parser.add_argument("--epoch", type=int, help="Epoch Amount", default=100)
 parser.add_argument("--conv", type=int, help="Conv Amount", default=3)
+parser.add_argument("--compile", action="store_true", help="Compile the model with torch.compile")
+parser.add_argument("--bf16", action="store_true", help="Train with bfloat16 features and weights (the aggregation stays fp32 on CPU)")
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 device = "cpu"
@@ -354,17 +369,19 @@ print("[DATA],", data)
 # region Execution
 if __name__ == "__main__":
 
-    test_dataset = dataset[: len(dataset) // 10]
-    train_dataset = dataset[len(dataset) // 10 :]
-    test_loader = DataLoader(test_dataset)
-    train_loader = DataLoader(train_dataset)
-
     args = parser.parse_args()
 
     epochs = args.epoch
     convs = args.conv
 
-    model = train(dataset, epochs=epochs, num_conv=convs, learning_rate=0.001)
+    model = train(
+        dataset,
+        epochs=epochs,
+        num_conv=convs,
+        learning_rate=0.001,
+        compile_model=args.compile,
+        bf16=args.bf16,
+    )
     model.__repr__()
     visualization_nodembs(dataset, model)
 
@@ -20,23 +20,23 @@ for i in paths:
 
 print(data["GCN"]['Epoch 0'])
 
-# Extract CPU, Memory, and Time data for each model
-epochs = list(data["GCN"].keys())
+# Extract CPU, Memory, and Time data for each model, with the epochs each model sampled
+epochs = {model: [int(epoch.split()[-1]) for epoch in data[model]] for model in data}
 # breakpoint()
-cpu_data = {model: [data[model][epoch]["CPU"] for epoch in epochs] for model in data}
-memory_data = {model: [data[model][epoch]["Memory"] for epoch in epochs] for model in data}
-time_data = {model: [data[model][epoch]["Time"] for epoch in epochs] for model in data}
+cpu_data = {model: [stats["CPU"] for stats in data[model].values()] for model in data}
+memory_data = {model: [stats["Memory"] for stats in data[model].values()] for model in data}
+time_data = {model: [stats["Time"] for stats in data[model].values()] for model in data}
 
 # Plot and save CPU comparison
 plt.figure(figsize=(10, 6))
 for model in cpu_data:
-    plt.plot(list(epochs), cpu_data[model], label=model)
+    plt.plot(epochs[model], cpu_data[model], label=model)
 plt.xlabel("Epoch")
 plt.ylabel("CPU Usage")
 plt.title("CPU Comparison")
 plt.legend()
 plt.xticks(rotation=45, ha='right')  # Rotate x-axis labels
-plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(5)) 
+plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(10)) 
 plt.tight_layout()  # Adjust layout to prevent overlap
 plt.grid(True)
 plt.savefig("Train/comp_per_model/cpu_comparison.png")
@@ -45,13 +45,13 @@ plt.show()
 # Plot and save Memory comparison
 plt.figure(figsize=(10, 6))
 for model in memory_data:
-    plt.plot(list(epochs), memory_data[model], label=model)
+    plt.plot(epochs[model], memory_data[model], label=model)
 plt.xlabel("Epoch")
 plt.ylabel("Memory Usage")
 plt.title("Memory Comparison")
 plt.legend()
 plt.xticks(rotation=45, ha='right')  # Rotate x-axis labels
-plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(5)) 
+plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(10)) 
 plt.tight_layout()  # Adjust layout to prevent overlap
 plt.grid(True)
 plt.savefig("Train/comp_per_model/memory_comparison.png")
@@ -60,13 +60,13 @@ plt.show()
 # Plot and save Time taken comparison
 plt.figure(figsize=(10, 6))
 for model in time_data:
-    plt.plot(list(epochs), time_data[model], label=model)
+    plt.plot(epochs[model], time_data[model], label=model)
 plt.xlabel("Epoch")
 plt.ylabel("Time Taken")
 plt.title("Time Taken Comparison")
 plt.legend()
 plt.xticks(rotation=45, ha='right')  # Rotate x-axis labels
-plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(5)) 
+plt.gca().xaxis.set_major_locator(ticker.MultipleLocator(10)) 
 plt.tight_layout()  # Adjust layout to prevent overlap
 plt.grid(True)
 plt.savefig("Train/comp_per_model/time_comparison.png")
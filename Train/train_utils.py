@@ -0,0 +1,20 @@
+import torch
+from sklearn.manifold import TSNE
+from sklearn.decomposition import PCA
+
+
+# Adam with the fused kernel on CUDA and the multi-tensor (foreach) update on CPU
+def build_adam(model, lr):
+    use_fused = next(model.parameters()).is_cuda
+    return torch.optim.Adam(
+        model.parameters(), lr=lr, fused=use_fused, foreach=not use_fused
+    )
+
+
+# 2D TSNE projection of the node embeddings, PCA reduced to at most 50 dimensions first
+def tsne_2d(X):
+    if X.shape[1] > 50:
+        X = PCA(n_components=50, random_state=42).fit_transform(X)
+
+    tsne = TSNE(n_jobs=-1, init="pca", learning_rate="auto", random_state=42)
+    return tsne.fit_transform(X)